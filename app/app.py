@@ -1,17 +1,28 @@
+import asyncio
+import hashlib
 import logging
-from fastapi import FastAPI, HTTPException
+import os
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, Response
 import uvicorn
-from typing import List
 from datetime import datetime
 from prometheus_fastapi_instrumentator import Instrumentator
-from modules.metrics import finops_http_requests_total
+from modules.metrics import finops_http_requests_total, http_request_counters, bind_http_request_counters
+from modules.prometheus import CircuitOpenError, close_prometheus_client, stop_push_worker
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create the FastAPI app
-app = FastAPI(title="FinOps API", description="A FinOps API for Kubernetes cost optimization")
+# Responses are float-heavy insight lists, which orjson encodes much faster
+# than the standard library json module
+app = FastAPI(
+    title="FinOps API",
+    description="A FinOps API for Kubernetes cost optimization",
+    default_response_class=ORJSONResponse,
+)
 
 # Initialize and apply instrumentation BEFORE defining routes
 instrumentator = Instrumentator(
@@ -26,12 +37,13 @@ instrumentator.instrument(app).expose(app)
 logger.info("Application instrumented with Prometheus metrics at /metrics")
 
 # Import our modules (AFTER instrumenting the app)
-from modules.models import CostEfficiency, Recommendation, CostAnomaly
 from modules.insights import (
     get_namespace_resources, 
     calculate_cost_efficiency,
     generate_recommendations,
     detect_cost_anomalies,
+    get_namespace_cost_series,
+    refresh_hot_queries_periodically,
 )
 
 # Now define all your routes and other app functionality
@@ -56,54 +68,95 @@ def handle_errors(func, *args, **kwargs):
         logger.error(f"Error in {func.__name__}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+# Async counterpart of handle_errors for coroutine insight functions
+async def handle_errors_async(func, *args, **kwargs):
+    """Wrapper to catch and log errors in async insight functions"""
+    try:
+        return await func(*args, **kwargs)
+    except CircuitOpenError as e:
+        # Prometheus is known to be down; skip the stack of error logs
+        logger.warning(f"Error in {func.__name__}: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Prometheus unavailable: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error in {func.__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+# Run anomaly detection for each namespace against the pre-fetched cost series
+def collect_anomalies(resource_data, cost_series):
+    """Detect cost anomalies for all namespaces in resource_data"""
+    cost_history, current_costs = cost_series
+    return [
+        handle_errors(
+            detect_cost_anomalies,
+            namespace,
+            cost_history.get(namespace, []),
+            current_costs.get(namespace, 0)
+        )
+        for namespace in resource_data.namespaces
+    ]
+
+# Respond with a content-hash ETag; pollers whose data hasn't changed since
+# their last request get an empty 304 instead of the full body
+def etag_response(request: Request, content):
+    """Encode content as JSON, or answer 304 if the client already has it"""
+    response = ORJSONResponse(jsonable_encoder(content))
+    tag = hashlib.blake2b(response.body, digest_size=8).hexdigest()
+    etag = f'W/"{tag}"'
+    # Weak comparison: W/"x" and "x" name the same entity
+    if_none_match = {
+        value.strip().removeprefix("W/")
+        for value in request.headers.get("if-none-match", "").split(",")
+    }
+    if f'"{tag}"' in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return response
+
 # Endpoint to get cost efficiency by namespace
-@app.get("/cost-efficiency", response_model=List[CostEfficiency])
-def get_cost_efficiency():
+@app.get("/cost-efficiency")
+async def get_cost_efficiency(request: Request):
     """Get cost efficiency scores for all namespaces"""
-    resource_data = handle_errors(get_namespace_resources)
-    return [handle_errors(calculate_cost_efficiency, data) for data in resource_data]
+    resource_data = await handle_errors_async(get_namespace_resources)
+    return etag_response(request, handle_errors(calculate_cost_efficiency, resource_data))
 
 # Endpoint to get optimization recommendations
-@app.get("/recommendations", response_model=List[Recommendation])
-def get_recommendations():
+@app.get("/recommendations")
+async def get_recommendations(request: Request):
     """Get cost optimization recommendations for all namespaces"""
-    resource_data = handle_errors(get_namespace_resources)
-    all_recommendations = []
-    
-    for data in resource_data:
-        namespace_recommendations = handle_errors(generate_recommendations, data)
-        all_recommendations.extend(namespace_recommendations)
-    
-    return all_recommendations
+    resource_data = await handle_errors_async(get_namespace_resources)
+    return etag_response(request, handle_errors(generate_recommendations, resource_data))
 
 # Endpoint to get cost anomalies
-@app.get("/cost-anomalies", response_model=List[CostAnomaly])
-def get_cost_anomalies():
+@app.get("/cost-anomalies")
+async def get_cost_anomalies(request: Request):
     """Get cost anomaly detection results for all namespaces"""
-    resource_data = handle_errors(get_namespace_resources)
-    return [handle_errors(detect_cost_anomalies, data.namespace) for data in resource_data]
+    resource_data, cost_series = await asyncio.gather(
+        handle_errors_async(get_namespace_resources),
+        handle_errors_async(get_namespace_cost_series),
+    )
+    return etag_response(request, collect_anomalies(resource_data, cost_series))
 
 # Endpoint to get all insights in one call
 @app.get("/all-insights")
-def get_all_insights():
+async def get_all_insights(request: Request):
     """Get all cost insights in one API call"""
-    resource_data = handle_errors(get_namespace_resources)
+    resource_data, cost_series = await asyncio.gather(
+        handle_errors_async(get_namespace_resources),
+        handle_errors_async(get_namespace_cost_series),
+    )
     
     # Generate all insights
-    efficiencies = [handle_errors(calculate_cost_efficiency, data) for data in resource_data]
+    efficiencies = handle_errors(calculate_cost_efficiency, resource_data)
     
-    recommendations = []
-    for data in resource_data:
-        namespace_recommendations = handle_errors(generate_recommendations, data)
-        recommendations.extend(namespace_recommendations)
+    recommendations = handle_errors(generate_recommendations, resource_data)
     
-    anomalies = [handle_errors(detect_cost_anomalies, data.namespace) for data in resource_data]
+    anomalies = collect_anomalies(resource_data, cost_series)
     
-    return {
+    return etag_response(request, {
         "cost_efficiencies": efficiencies,
         "recommendations": recommendations,
         "cost_anomalies": anomalies, 
-    }
+    })
 
 # Force update of app metrics
 @app.post("/update-metrics")
@@ -117,33 +170,66 @@ def force_update_metrics():
 async def metrics_middleware(request, call_next):
     response = await call_next(request)
     
-    # Update request metrics
-    finops_http_requests_total.labels(
-        method=request.method,
-        endpoint=request.url.path,
-        status=response.status_code
-    ).inc()
+    # Update request metrics, using the pre-bound child for known routes
+    key = (request.method, request.url.path, response.status_code)
+    counter = http_request_counters.get(key)
+    if counter is None:
+        counter = finops_http_requests_total.labels(*key)
+    counter.inc()
     
     return response
 
 @app.on_event("startup")
 async def startup():
+    # All routes are registered by now, so bind their request counters once
+    bind_http_request_counters(app.routes)
+    
     # Initialize metrics by running insight functions
     try:
         logger.info("Initializing metrics...")
-        resource_data = handle_errors(get_namespace_resources)
+        resource_data, cost_series = await asyncio.gather(
+            handle_errors_async(get_namespace_resources),
+            handle_errors_async(get_namespace_cost_series),
+        )
         
         if resource_data:
-            for data in resource_data:
-                # Call each function to generate initial metrics
-                handle_errors(calculate_cost_efficiency, data)
-                handle_errors(generate_recommendations, data)
-                handle_errors(detect_cost_anomalies, data.namespace)
+            # Call each function to generate initial metrics
+            handle_errors(calculate_cost_efficiency, resource_data)
+            handle_errors(generate_recommendations, resource_data)
+            collect_anomalies(resource_data, cost_series)
                 
             logger.info(f"Metrics initialized for {len(resource_data)} namespaces")
     except Exception as e:
         logger.error(f"Error initializing metrics: {str(e)}")
+    
+    # Keep the hot insight queries fresh in the background
+    app.state.hot_query_refreshers = refresh_hot_queries_periodically()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for refresher in app.state.hot_query_refreshers:
+        refresher.cancel()
+    
+    # Release pooled Prometheus connections
+    await close_prometheus_client()
+    
+    # Send any queued Pushgateway pushes before exiting, without blocking
+    # the event loop
+    await asyncio.to_thread(stop_push_worker)
 
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, log_level="info")
+    # uvloop and httptools replace the default asyncio loop and h11 parser.
+    # Gauges and caches live in-process, so keep one worker per pod unless
+    # WEB_CONCURRENCY says otherwise; scale with replicas instead.
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        log_level="info",
+        access_log=False,
+    )
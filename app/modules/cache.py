@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import math
+import time
+
+
+def async_ttl_cache(ttl: float, maxsize: int = None, cache_if=None, key=None):
+    """
+    Cache the results of a coroutine function for ttl seconds, keyed by its
+    positional arguments, or by key(*args) when key is given.
+
+    Callers that arrive while a call for the same key is still running await
+    that call instead of starting their own, so a burst of requests results in
+    a single upstream query. Failed calls are not cached, and neither are
+    results for which cache_if(result) is false. When maxsize is set, the
+    oldest entry is evicted to make room for a new one.
+    """
+    def decorator(func):
+        # key -> (expires_at, future). Everything runs on the event loop thread,
+        # so the check-then-set in wrapper needs no lock.
+        entries = {}
+
+        def on_done(cache_key, future):
+            if entries.get(cache_key, (None, None))[1] is not future:
+                return
+            if (future.cancelled() or future.exception() is not None
+                    or (cache_if is not None and not cache_if(future.result()))):
+                del entries[cache_key]
+            else:
+                entries[cache_key] = (time.monotonic() + ttl, future)
+
+        def insert(cache_key, entry):
+            # Re-insert so entries stay ordered oldest first
+            entries.pop(cache_key, None)
+            if maxsize is not None and len(entries) >= maxsize:
+                del entries[next(iter(entries))]
+            entries[cache_key] = entry
+
+        @functools.wraps(func)
+        async def wrapper(*args):
+            cache_key = args if key is None else key(*args)
+            entry = entries.get(cache_key)
+            if entry is None or (entry[1].done() and time.monotonic() >= entry[0]):
+                future = asyncio.ensure_future(func(*args))
+                # The TTL starts once the call completes
+                insert(cache_key, (math.inf, future))
+                future.add_done_callback(functools.partial(on_done, cache_key))
+                entry = entries[cache_key]
+            # Shield so one caller being cancelled doesn't cancel the shared call
+            return await asyncio.shield(entry[1])
+
+        async def refresh(*args):
+            """
+            Recompute the entry for args. The cached value keeps being served
+            until the new one is ready, and is kept if the call fails. A
+            result rejected by cache_if is not stored and drops the entry,
+            as on a miss.
+            """
+            cache_key = args if key is None else key(*args)
+            future = asyncio.ensure_future(func(*args))
+            result = await future
+            if cache_if is not None and not cache_if(result):
+                entries.pop(cache_key, None)
+            else:
+                insert(cache_key, (time.monotonic() + ttl, future))
+            return result
+
+        wrapper.refresh = refresh
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
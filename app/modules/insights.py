@@ -1,428 +1,371 @@
+import asyncio
+import math
 import os
 import logging
-from typing import List
+import time
+from typing import Dict, List, Tuple
 import numpy as np
 
-from .models import ResourceData, CostEfficiency, Recommendation, CostAnomaly
-from .prometheus import query_prometheus, extract_metric_value
+from .cache import async_ttl_cache
+from .models import RESOURCE_FIELDS, NamespaceTable, CostEfficiency, Recommendation, CostAnomaly
+from .prometheus import query_prometheus, query_prometheus_range, refresh_instant_query, extract_namespace_results, iter_series
+from .metrics import (
+    anomaly_score_for,
+    efficiency_score_for,
+    optimization_savings_for,
+    resource_utilization_for,
+    resource_waste_for,
+)
 
-from modules.metrics import *
 logger = logging.getLogger(__name__)
 
 # Environment variables with default values
 CPU_HOURLY_COST = float(os.getenv("CPU_HOURLY_COST", "0.0432"))
 MEMORY_GB_HOURLY_COST = float(os.getenv("MEMORY_GB_HOURLY_COST", "0.0108"))
 
-def get_namespace_resources() -> List[ResourceData]:
-    """
-    Collect resource usage and allocation data for all namespaces
-    """
-    results = {}
-    
-    # Get CPU requests by namespace
-    cpu_requests = query_prometheus(
-        "sum(kube_pod_container_resource_requests{resource='cpu',service='prometheus-kube-state-metrics'}) by (namespace)"
-    )
-    
-    # Get CPU usage by namespace
-    cpu_usage = query_prometheus(
-        "sum(rate(container_cpu_usage_seconds_total{container!=''}[1h])) by (namespace)"
-    )
-    
-    # Get CPU limits by namespace
-    cpu_limits = query_prometheus(
-        "sum(kube_pod_container_resource_limits{resource='cpu'}) by (namespace)"
-    )
-    
-    # Get memory requests by namespace
-    memory_requests = query_prometheus(
-        "sum(kube_pod_container_resource_requests{resource='memory',service='prometheus-kube-state-metrics'}) by (namespace) / 1024 / 1024 / 1024"
-    )
-    
-    # Get memory usage by namespace
-    memory_usage = query_prometheus(
-        "sum(container_memory_working_set_bytes{container!=''}) by (namespace) / 1024 / 1024 / 1024"
-    )
-    
-    # Get memory limits by namespace
-    memory_limits = query_prometheus(
-        "sum(kube_pod_container_resource_limits{resource='memory'}) by (namespace) / 1024 / 1024 / 1024"
-    )
-    
-    # Get namespace cost
-    namespace_costs = query_prometheus(
-        """
+# Average hours in a month, and the monthly cost of one CPU core / GB of memory
+HOURS_PER_MONTH = 730
+CPU_MONTHLY_COST = CPU_HOURLY_COST * HOURS_PER_MONTH
+MEMORY_GB_MONTHLY_COST = MEMORY_GB_HOURLY_COST * HOURS_PER_MONTH
+
+# Seconds to reuse Prometheus-derived data; roughly one scrape interval.
+# Refreshed in the background (see refresh_hot_queries_periodically)
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "15"))
+# Seconds to reuse the cost history used for anomaly detection; it is hourly
+# data, also refreshed in the background
+COST_SERIES_CACHE_TTL_SECONDS = float(os.getenv("COST_SERIES_CACHE_TTL_SECONDS", "60"))
+
+# PromQL for each NamespaceTable field, by namespace
+RESOURCE_QUERIES = {
+    # CPU requests, usage and limits (cores)
+    'cpu_request': "sum(kube_pod_container_resource_requests{resource='cpu',service='prometheus-kube-state-metrics'}) by (namespace)",
+    'cpu_usage': "sum(rate(container_cpu_usage_seconds_total{container!=''}[1h])) by (namespace)",
+    'cpu_limit': "sum(kube_pod_container_resource_limits{resource='cpu'}) by (namespace)",
+    # Memory requests, usage and limits (GiB)
+    'memory_request': "sum(kube_pod_container_resource_requests{resource='memory',service='prometheus-kube-state-metrics'}) by (namespace) / 1024 / 1024 / 1024",
+    'memory_usage': "sum(container_memory_working_set_bytes{container!=''}) by (namespace) / 1024 / 1024 / 1024",
+    'memory_limit': "sum(kube_pod_container_resource_limits{resource='memory'}) by (namespace) / 1024 / 1024 / 1024",
+    # Monthly namespace cost
+    'cost': f"""
         sum(
           (
             sum(container_memory_allocation_bytes) by (namespace)
             * on() group_left()
-            (avg(node_ram_hourly_cost) / (1024 * 1024 * 1024) * 730)
+            (avg(node_ram_hourly_cost) / (1024 * 1024 * 1024) * {HOURS_PER_MONTH})
           )
           +
           (
             sum(container_cpu_allocation) by (namespace)
             * on() group_left()
-            (avg(node_cpu_hourly_cost) * 730)
+            (avg(node_cpu_hourly_cost) * {HOURS_PER_MONTH})
           )
         ) by (namespace)
-        """
-    )
-    
-    # Process data for all namespaces
-    all_namespaces = set()
-    
-    # Collect all unique namespaces
-    for query_result in [cpu_requests, cpu_usage, cpu_limits, memory_requests, memory_usage, memory_limits, namespace_costs]:
-        if query_result and 'data' in query_result and 'result' in query_result['data']:
-            for item in query_result['data']['result']:
-                if 'metric' in item and 'namespace' in item['metric']:
-                    all_namespaces.add(item['metric']['namespace'])
-    
-    # Initialize data for all namespaces
-    for namespace in all_namespaces:
-        results[namespace] = {
-            'cpu_request': 0,
-            'cpu_usage': 0,
-            'cpu_limit': 0,
-            'memory_request': 0,
-            'memory_usage': 0,
-            'memory_limit': 0,
-            'cost': 0
-        }
-    
-    # Fill in CPU requests
-    if cpu_requests and 'data' in cpu_requests and 'result' in cpu_requests['data']:
-        for item in cpu_requests['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['cpu_request'] = float(item['value'][1])
-    
-    # Fill in CPU usage
-    if cpu_usage and 'data' in cpu_usage and 'result' in cpu_usage['data']:
-        for item in cpu_usage['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['cpu_usage'] = float(item['value'][1])
+    """,
+}
+
+# All resource queries as a single union, each series tagged with a "field"
+# label so get_namespace_resources can route it to the right column
+NAMESPACE_RESOURCES_QUERY = "\nor\n".join(
+    f'label_replace({query}, "field", "{field}", "", "")' for field, query in RESOURCE_QUERIES.items()
+)
+
+# Recorded hourly cost per namespace, see finops-recording-rules.yaml
+NAMESPACE_HOURLY_COST = "finops:namespace_cost:hourly"
+
+@async_ttl_cache(ttl=CACHE_TTL_SECONDS)
+async def get_namespace_resources() -> NamespaceTable:
+    """
+    Collect resource usage and allocation data for all namespaces
+    """
+    # One round-trip for all fields; each series carries the field it fills
+    resources = await query_prometheus(NAMESPACE_RESOURCES_QUERY)
     
-    # Fill in CPU limits
-    if cpu_limits and 'data' in cpu_limits and 'result' in cpu_limits['data']:
-        for item in cpu_limits['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['cpu_limit'] = float(item['value'][1])
+    # Namespaces get a row the first time any series reports them, with every
+    # field defaulting to 0 until its own series fills it in
+    rows = {}
+    columns = {field: [] for field in RESOURCE_FIELDS}
     
-    # Fill in memory requests
-    if memory_requests and 'data' in memory_requests and 'result' in memory_requests['data']:
-        for item in memory_requests['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['memory_request'] = float(item['value'][1])
+    for namespace, field, value in iter_series(resources, 'namespace', 'field'):
+        row = rows.get(namespace)
+        if row is None:
+            row = rows[namespace] = len(rows)
+            for column in columns.values():
+                column.append(0.0)
+        columns[field][row] = value
     
-    # Fill in memory usage
-    if memory_usage and 'data' in memory_usage and 'result' in memory_usage['data']:
-        for item in memory_usage['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['memory_usage'] = float(item['value'][1])
+    return NamespaceTable(
+        namespaces=list(rows),
+        **{field: np.array(column, dtype=np.float64) for field, column in columns.items()}
+    )
+
+def calculate_cost_efficiency(table: NamespaceTable) -> List[CostEfficiency]:
+    """
+    Calculate cost efficiency scores (0-100) based on resource utilization,
+    for all namespaces at once
+    """
+    # Requests of 0 are replaced by 1 when dividing; those rows are zeroed below
+    has_cpu_request = table.cpu_request > 0
+    has_memory_request = table.memory_request > 0
+    cpu_request = np.where(has_cpu_request, table.cpu_request, 1)
+    memory_request = np.where(has_memory_request, table.memory_request, 1)
     
-    # Fill in memory limits
-    if memory_limits and 'data' in memory_limits and 'result' in memory_limits['data']:
-        for item in memory_limits['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['memory_limit'] = float(item['value'][1])
+    # Calculate usage ratios and wasted resources percentages
+    cpu_usage_ratio = np.where(has_cpu_request, table.cpu_usage / cpu_request, 0)
+    memory_usage_ratio = np.where(has_memory_request, table.memory_usage / memory_request, 0)
+    wasted_cpu_percent = np.where(has_cpu_request, np.maximum(0, (table.cpu_request - table.cpu_usage) / cpu_request * 100), 0)
+    wasted_memory_percent = np.where(has_memory_request, np.maximum(0, (table.memory_request - table.memory_usage) / memory_request * 100), 0)
     
-    # Fill in namespace costs
-    if namespace_costs and 'data' in namespace_costs and 'result' in namespace_costs['data']:
-        for item in namespace_costs['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace]['cost'] = float(item['value'][1])
+    # Calculate efficiency score - higher is better (less waste)
+    # We weigh CPU and memory equally for the score, clamped to 0-100
+    efficiency_score = np.clip(100 - (wasted_cpu_percent + wasted_memory_percent) / 2, 0, 100)
     
-    # Convert to list of ResourceData objects
-    return [
-        ResourceData(
-            namespace=namespace,
-            **data
+    efficiencies = []
+    for namespace, score, wasted_cpu, wasted_memory, cpu_ratio, memory_ratio in zip(
+        table.namespaces,
+        efficiency_score.tolist(),
+        wasted_cpu_percent.tolist(),
+        wasted_memory_percent.tolist(),
+        cpu_usage_ratio.tolist(),
+        memory_usage_ratio.tolist(),
+    ):
+        efficiency_score_for(namespace).set(score)
+        resource_waste_for(namespace, "cpu").set(wasted_cpu)
+        resource_waste_for(namespace, "memory").set(wasted_memory)
+        resource_utilization_for(namespace, "cpu").set(cpu_ratio)
+        resource_utilization_for(namespace, "memory").set(memory_ratio)
+        
+        efficiencies.append(
+            CostEfficiency.model_construct(
+                namespace=namespace,
+                efficiency_score=score,
+                wasted_cpu_percent=wasted_cpu,
+                wasted_memory_percent=wasted_memory
+            )
         )
-        for namespace, data in results.items()
-    ]
+    
+    return efficiencies
 
-def calculate_cost_efficiency(resource_data: ResourceData) -> CostEfficiency:
+def generate_recommendations(table: NamespaceTable) -> List[Recommendation]:
     """
-    Calculate cost efficiency score (0-100) based on resource utilization
+    Generate cost optimization recommendations based on resource utilization,
+    for all namespaces at once
     """
-    # Calculate wasted resources percentages
-    wasted_cpu_percent = 0
-    if resource_data.cpu_request > 0:
-        wasted_cpu_percent = max(0, (resource_data.cpu_request - resource_data.cpu_usage) / resource_data.cpu_request * 100)
+    has_cpu_request = table.cpu_request > 0
+    has_memory_request = table.memory_request > 0
     
-    wasted_memory_percent = 0
-    if resource_data.memory_request > 0:
-        wasted_memory_percent = max(0, (resource_data.memory_request - resource_data.memory_usage) / resource_data.memory_request * 100)
+    # Recommend a value 30% higher than actual usage for safety
+    recommended_cpu = np.maximum(0.1, table.cpu_usage * 1.3)
+    recommended_memory = np.maximum(0.1, table.memory_usage * 1.3)
     
-    # Calculate efficiency score - higher is better (less waste)
-    # We weigh CPU and memory equally for the score
-    efficiency_score = 100 - (wasted_cpu_percent + wasted_memory_percent) / 2
+    # Calculate savings
+    monthly_cpu_savings = (table.cpu_request - recommended_cpu) * CPU_MONTHLY_COST
+    monthly_memory_savings = (table.memory_request - recommended_memory) * MEMORY_GB_MONTHLY_COST
     
-    # Ensure the score is between 0 and 100
-    efficiency_score = max(0, min(100, efficiency_score))
-
-    finops_efficiency_score.labels(exported_namespace=resource_data.namespace).set(efficiency_score)
-    finops_resource_waste.labels(exported_namespace=resource_data.namespace, resource_type="cpu").set(wasted_cpu_percent)
-    finops_resource_waste.labels(exported_namespace=resource_data.namespace, resource_type="memory").set(wasted_memory_percent)
+    # Requests can be optimized if usage is much lower than the request and
+    # the savings are meaningful
+    cpu_rightsizing = (
+        has_cpu_request
+        & (table.cpu_usage / np.where(has_cpu_request, table.cpu_request, 1) < 0.7)
+        & (monthly_cpu_savings > 1.0)
+    )
+    memory_rightsizing = (
+        has_memory_request
+        & (table.memory_usage / np.where(has_memory_request, table.memory_request, 1) < 0.7)
+        & (monthly_memory_savings > 1.0)
+    )
     
-    # Calculate and update usage ratios
-    cpu_usage_ratio = resource_data.cpu_usage / resource_data.cpu_request if resource_data.cpu_request > 0 else 0
-    memory_usage_ratio = resource_data.memory_usage / resource_data.memory_request if resource_data.memory_request > 0 else 0
+    # Plain Python values for building the recommendations below
+    namespaces = table.namespaces
+    cpu_request = table.cpu_request.tolist()
+    memory_request = table.memory_request.tolist()
+    recommended_cpu = recommended_cpu.tolist()
+    recommended_memory = recommended_memory.tolist()
+    monthly_cpu_savings = monthly_cpu_savings.tolist()
+    monthly_memory_savings = monthly_memory_savings.tolist()
     
-    finops_resource_utilization.labels(exported_namespace=resource_data.namespace, resource_type="cpu").set(cpu_usage_ratio)
-    finops_resource_utilization.labels(exported_namespace=resource_data.namespace, resource_type="memory").set(memory_usage_ratio)
-
-    return CostEfficiency(
-        namespace=resource_data.namespace,
-        efficiency_score=efficiency_score,
-        wasted_cpu_percent=wasted_cpu_percent,
-        wasted_memory_percent=wasted_memory_percent
-    )
-
-def generate_recommendations(resource_data: ResourceData) -> List[Recommendation]:
-    """
-    Generate cost optimization recommendations based on resource utilization
-    """
-    recommendations = []
+    # Recommendations are collected per namespace to keep them grouped in
+    # table order in the returned list
+    by_namespace = [[] for _ in namespaces]
     
-    # Check if CPU request can be optimized (if usage is much lower than request)
-
-    if resource_data.cpu_request > 0 and resource_data.cpu_usage / resource_data.cpu_request < 0.7:
-        # Recommend a value 30% higher than actual usage for safety
-        recommended_cpu = max(0.1, resource_data.cpu_usage * 1.3)
-        
-        # Calculate savings
-        monthly_cpu_savings = (resource_data.cpu_request - recommended_cpu) * CPU_HOURLY_COST * 730
-        
-        if monthly_cpu_savings > 1.0:  # Only recommend if savings are meaningful
-            recommendations.append(
-                Recommendation(
-                    namespace=resource_data.namespace,
-                    recommendation_type="cpu_request_rightsizing",
-                    description=f"Reduce CPU requests to match actual usage plus a 30% buffer",
-                    estimated_savings=monthly_cpu_savings,
-                    current_value=resource_data.cpu_request,
-                    recommended_value=recommended_cpu
-                )
+    for i in np.flatnonzero(cpu_rightsizing).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
+                recommendation_type="cpu_request_rightsizing",
+                description=f"Reduce CPU requests to match actual usage plus a 30% buffer",
+                estimated_savings=monthly_cpu_savings[i],
+                current_value=cpu_request[i],
+                recommended_value=recommended_cpu[i]
             )
-                
-    # Check if memory request can be optimized
-    if resource_data.memory_request > 0 and resource_data.memory_usage / resource_data.memory_request < 0.7:
-        # Recommend a value 30% higher than actual usage for safety
-        recommended_memory = max(0.1, resource_data.memory_usage * 1.3)
-        
-        # Calculate savings
-        monthly_memory_savings = (resource_data.memory_request - recommended_memory) * MEMORY_GB_HOURLY_COST * 730
-        
-        if monthly_memory_savings > 1.0:  # Only recommend if savings are meaningful
-            recommendations.append(
-                Recommendation(
-                    namespace=resource_data.namespace,
-                    recommendation_type="memory_request_rightsizing",
-                    description=f"Reduce memory requests to match actual usage plus a 30% buffer",
-                    estimated_savings=monthly_memory_savings,
-                    current_value=resource_data.memory_request,
-                    recommended_value=recommended_memory
-                )
+        )
+    
+    for i in np.flatnonzero(memory_rightsizing).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
+                recommendation_type="memory_request_rightsizing",
+                description=f"Reduce memory requests to match actual usage plus a 30% buffer",
+                estimated_savings=monthly_memory_savings[i],
+                current_value=memory_request[i],
+                recommended_value=recommended_memory[i]
             )
+        )
     
     # Check for missing resource limits
-    if resource_data.cpu_request > 0:
-        if resource_data.cpu_limit == 0:
-            recommendations.append(
-                Recommendation(
-                    namespace=resource_data.namespace,
-                    recommendation_type="add_cpu_limits",
-                    description="Add CPU limits to prevent resource hogging",
-                    estimated_savings=0.0,  # No direct cost savings but improves cluster stability
-                    current_value="No limit",
-                    recommended_value=str(max(1, resource_data.cpu_request * 2))  # Recommend 2x the request
-                )
+    for i in np.flatnonzero(has_cpu_request & (table.cpu_limit == 0)).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
+                recommendation_type="add_cpu_limits",
+                description="Add CPU limits to prevent resource hogging",
+                estimated_savings=0.0,  # No direct cost savings but improves cluster stability
+                current_value="No limit",
+                recommended_value=str(max(1, cpu_request[i] * 2))  # Recommend 2x the request
             )
-    else:
-        recommended_cpu = max(0.1, resource_data.cpu_usage * 1.3)
-        recommendations.append(
-            Recommendation(
-                namespace=resource_data.namespace,
+        )
+    
+    for i in np.flatnonzero(~has_cpu_request).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
                 recommendation_type="add_cpu_limits_and_requests",
                 description="Add CPU limits and Requests to prevent resource hogging",
                 estimated_savings=0.0,  # No direct cost savings but improves cluster stability
                 current_value="No limit",
-                recommended_value=str(max(1, recommended_cpu )),  # Recommend 1.3x the usage
-                recommended_value2=str(max(1, recommended_cpu * 2))  # Recommend 2x the request
+                recommended_value=str(max(1, recommended_cpu[i])),  # Recommend 1.3x the usage
+                recommended_value2=str(max(1, recommended_cpu[i] * 2))  # Recommend 2x the request
             )
         )
-
-    if resource_data.memory_request > 0:  
-        if resource_data.memory_limit == 0:
-            recommendations.append(
-                Recommendation(
-                    namespace=resource_data.namespace,
-                    recommendation_type="add_memory_limits",
-                    description="Add memory limits to prevent resource hogging",
-                    estimated_savings=0.0,  # No direct cost savings but improves cluster stability
-                    current_value="No limit",
-                    recommended_value=str(max(1, resource_data.memory_request * 1.5))  # Recommend 1.5x the request
-                )
+    
+    for i in np.flatnonzero(has_memory_request & (table.memory_limit == 0)).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
+                recommendation_type="add_memory_limits",
+                description="Add memory limits to prevent resource hogging",
+                estimated_savings=0.0,  # No direct cost savings but improves cluster stability
+                current_value="No limit",
+                recommended_value=str(max(1, memory_request[i] * 1.5))  # Recommend 1.5x the request
             )
-    else:
-        recommended_memory = max(0.1, resource_data.memory_usage * 1.3)
-        recommendations.append(
-            Recommendation(
-                namespace=resource_data.namespace,
+        )
+    
+    for i in np.flatnonzero(~has_memory_request).tolist():
+        by_namespace[i].append(
+            Recommendation.model_construct(
+                namespace=namespaces[i],
                 recommendation_type="add_memory_limits_and_requests",
                 description="Add Memory limits and Requests to prevent resource hogging",
                 estimated_savings=0.0,  # No direct cost savings but improves cluster stability
                 current_value="No limit",
-                recommended_value=str(max(1, recommended_memory )),  # Recommend 1.3x the usage
-                recommended_value2=str(max(1, recommended_memory * 1.5))  # Recommend 2x the request
+                recommended_value=str(max(1, recommended_memory[i])),  # Recommend 1.3x the usage
+                recommended_value2=str(max(1, recommended_memory[i] * 1.5))  # Recommend 2x the request
             )
         )
+    
+    recommendations = [recommendation for group in by_namespace for recommendation in group]
+    
     for recommendation in recommendations:
         if isinstance(recommendation.estimated_savings, (int, float)):
-            finops_optimization_savings.labels(
-                exported_namespace=recommendation.namespace,
-                recommendation_type=recommendation.recommendation_type
+            optimization_savings_for(
+                recommendation.namespace,
+                recommendation.recommendation_type
             ).set(recommendation.estimated_savings)
     
     return recommendations
 
-def detect_cost_anomalies(namespace: str) -> CostAnomaly:
+@async_ttl_cache(ttl=COST_SERIES_CACHE_TTL_SECONDS)
+async def get_namespace_cost_series() -> Tuple[Dict[str, List[float]], Dict[str, float]]:
     """
-    Detect unusual patterns in cost data compared to historical trends
-    using statistical methods
+    Collect the hourly cost history (past 7 days) and the current hourly cost
+    for all namespaces, using one query per series instead of one per namespace
     """
-    # Get hourly cost data for the past 7 days
-    hourly_cost_query = f"""
-    sum(
-        (
-          sum(container_memory_allocation_bytes{{namespace="{namespace}"}})
-          * on() group_left()
-          (avg(node_ram_hourly_cost) / (1024 * 1024 * 1024) * 1)
-        )
-        +
-        (
-          sum(container_cpu_allocation{{namespace="{namespace}"}})
-          * on() group_left()
-          (avg(node_cpu_hourly_cost) * 1)
-        )
-        +
-        (
-          sum(
-            sum(
-                kube_persistentvolume_capacity_bytes{{job="opencost"}} / (1024 * 1024 * 1024)
-            ) by (persistentvolume)
-            *
-            sum(pv_hourly_cost{{job=~"opencost"}}) by (persistentvolume)
-            * on(persistentvolume) group_left(namespace) (
-              label_replace(
-                kube_persistentvolumeclaim_info{{job="opencost",namespace="{namespace}"}},
-                "persistentvolume", "$1",
-                "volumename", "(.*)"
-              )
-            )
-          )      
-          OR
-          vector(0)
-        )
-        +
-        (
-          sum(kubecost_load_balancer_cost{{namespace="{namespace}"}})
-          OR
-          vector(0)
-        )
-      )[7d:1h]
-    """
-    
-    # Get current cost
-    current_cost_query = f"""
-    (
-      sum(
-        (
-          sum(container_memory_allocation_bytes{{namespace="{namespace}"}})
-          * on() group_left()
-            (avg(node_ram_hourly_cost) / (1024 * 1024 * 1024) * 1)
-        )
-        +
-        (
-          sum(container_cpu_allocation{{namespace="{namespace}"}})
-          * on() group_left()
-            (avg(node_cpu_hourly_cost) * 1)
-        )
-      )
-    )
-    +
-    (
-      sum(
-        sum(
-            kube_persistentvolume_capacity_bytes{{job="opencost"}} / (1024 * 1024 * 1024)
-        ) by (persistentvolume)
-        *
-        sum(pv_hourly_cost{{job=~"opencost"}}) by (persistentvolume)
-        * on(persistentvolume) group_left(namespace) (
-          label_replace(
-            kube_persistentvolumeclaim_info{{job="opencost",namespace="{namespace}"}},
-            "persistentvolume", "$1",
-            "volumename", "(.*)"
-          )
-        )
-      )      
-      OR
-      vector(0)
+    # Hourly cost by namespace is precomputed by the finops:namespace_cost:hourly
+    # recording rule (finops-recording-rules.yaml), so both queries read a
+    # stored series instead of re-evaluating the cost formula
+    end = time.time()
+    hourly_cost_data, current_cost_data = await asyncio.gather(
+        query_prometheus_range(NAMESPACE_HOURLY_COST, start=end - 7 * 24 * 3600, end=end, step="1h"),
+        query_prometheus(NAMESPACE_HOURLY_COST),
     )
-    +
-    (
-        sum(kubecost_load_balancer_cost{{namespace="{namespace}"}}) OR vector(0)
-    )
-    """
     
-    # Execute queries
-    hourly_cost_data = query_prometheus(hourly_cost_query)
-    current_cost_data = query_prometheus(current_cost_query)
-    
-    # Extract current cost
-    current_cost = extract_metric_value(current_cost_data, default=0)
+    history = {}
+    for item in hourly_cost_data.result:
+        if 'metric' in item and 'namespace' in item['metric'] and 'values' in item:
+            history[item['metric']['namespace']] = [float(value[1]) for value in item['values']]
     
+    return history, extract_namespace_results(current_cost_data)
+
+# Cached queries behind every insight endpoint, kept warm in the background,
+# with the instant queries they read and their refresh interval. Each is
+# refreshed at half its TTL, so the entry never expires and Prometheus sees
+# one round of queries per interval however many requests come in
+HOT_QUERIES = (
+    (get_namespace_resources, (NAMESPACE_RESOURCES_QUERY,), CACHE_TTL_SECONDS / 2),
+    (get_namespace_cost_series, (NAMESPACE_HOURLY_COST,), COST_SERIES_CACHE_TTL_SECONDS / 2),
+)
+
+async def refresh_periodically(cached_query, instant_queries, interval: float):
+    """
+    Refresh a cached query every interval seconds, so requests are served
+    from memory instead of waiting on Prometheus
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Re-fetch the instant queries first; otherwise the refresh would
+            # be answered from the instant query cache, up to PROM_CACHE_TTL old
+            for query in instant_queries:
+                await refresh_instant_query(query)
+            await cached_query.refresh()
+        except Exception as e:
+            logger.warning(f"Failed to refresh {cached_query.__name__}: {e}")
+
+def refresh_hot_queries_periodically() -> List[asyncio.Task]:
+    """
+    Start a background refresh task for each of HOT_QUERIES
+    """
+    return [
+        asyncio.create_task(refresh_periodically(cached_query, instant_queries, interval))
+        for cached_query, instant_queries, interval in HOT_QUERIES
+    ]
+
+def _zscore(data_points: List[float], current: float) -> Tuple[float, float, float]:
+    """
+    Return the mean, population standard deviation and absolute Z-score of
+    current against data_points (Z-score is 0 when the deviation is 0)
+    """
+    # Plain Python beats numpy here: the series is at most a few hundred
+    # points, so numpy's call and conversion overhead outweighs the arithmetic
+    n = len(data_points)
+    mean = sum(data_points) / n
+    std = math.sqrt(sum((x - mean) ** 2 for x in data_points) / n)
+    z_score = abs((current - mean) / std) if std > 0 else 0.0
+    return mean, std, z_score
+
+def detect_cost_anomalies(namespace: str, data_points: List[float], current_cost: float) -> CostAnomaly:
+    """
+    Detect unusual patterns in cost data compared to historical trends
+    using statistical methods
+    """
     # Process historical data for statistical analysis
     try:
-        data_points = []
-
-        if 'data' in hourly_cost_data and 'result' in hourly_cost_data['data'] and hourly_cost_data['data']['result']:
-            for value in hourly_cost_data['data']['result'][0]['values']:
-                data_points.append(float(value[1]))
-            if len(data_points) > 24:  # Ensure we have at least a day of hourly data
-                
-                # Calculate mean and standard deviation
-                mean_cost = np.mean(data_points)
-                std_cost = np.std(data_points)
-                
-                # Calculate Z-score for current cost
-                if std_cost > 0:
-                    z_score = abs((current_cost - mean_cost) / std_cost)
-                    
-                    # Convert Z-score to anomaly score (0-100)
-                    # Z-score of 2 (95% confidence) = 50% anomaly
-                    # Z-score of 3 (99.7% confidence) = 100% anomaly
-                    anomaly_score = min(100, max(0, (z_score - 1) * 50))
-                else:
-                    # If std is 0, we can't calculate z-score
-                    anomaly_score = 0 if current_cost == mean_cost else 100
-                
-                increase_percent = ((current_cost - mean_cost) / mean_cost * 100) if mean_cost > 0 else 0
+        if len(data_points) > 24:  # Ensure we have at least a day of hourly data
+            
+            # Calculate mean, standard deviation and Z-score for current cost
+            mean_cost, std_cost, z_score = _zscore(data_points, current_cost)
+            
+            if std_cost > 0:
+                # Convert Z-score to anomaly score (0-100)
+                # Z-score of 2 (95% confidence) = 50% anomaly
+                # Z-score of 3 (99.7% confidence) = 100% anomaly
+                anomaly_score = min(100, max(0, (z_score - 1) * 50))
             else:
-                # Not enough data points
-                anomaly_score = 0
-                increase_percent = 0
-                mean_cost = current_cost
+                # If std is 0, we can't calculate z-score
+                anomaly_score = 0 if current_cost == mean_cost else 100
+            
+            increase_percent = ((current_cost - mean_cost) / mean_cost * 100) if mean_cost > 0 else 0
         else:
-            # No data available
+            # Not enough data points
             anomaly_score = 0
             increase_percent = 0
             mean_cost = current_cost
@@ -433,13 +376,12 @@ def detect_cost_anomalies(namespace: str) -> CostAnomaly:
         increase_percent = 0
         mean_cost = current_cost
         
-    finops_anomaly_score.labels(exported_namespace=namespace).set(anomaly_score)
+    anomaly_score_for(namespace).set(anomaly_score)
     
-    return CostAnomaly(
+    return CostAnomaly.model_construct(
         namespace=namespace,
-        usual_cost=mean_cost,
-        current_cost=current_cost,
-        increase_percent=increase_percent,
-        anomaly_score=anomaly_score
+        usual_cost=float(mean_cost),
+        current_cost=float(current_cost),
+        increase_percent=float(increase_percent),
+        anomaly_score=float(anomaly_score)
     )
-
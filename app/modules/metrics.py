@@ -1,3 +1,4 @@
+from functools import lru_cache
 from prometheus_client import Gauge, Counter
 
 # Basic API metrics
@@ -7,6 +8,18 @@ finops_http_requests_total = Counter(
     ['method', 'endpoint', 'status']
 )
 
+# finops_http_requests_total children bound ahead of time, keyed by
+# (method, endpoint, status), so the request path skips label resolution
+http_request_counters = {}
+
+def bind_http_request_counters(routes, statuses=(200, 304, 404, 500)):
+    """Pre-create finops_http_requests_total children for the given routes"""
+    for route in routes:
+        for method in getattr(route, 'methods', None) or ():
+            for status in statuses:
+                key = (method, route.path, status)
+                http_request_counters[key] = finops_http_requests_total.labels(*key)
+
 # FinOps specific metrics
 finops_efficiency_score = Gauge(
     'finops_efficiency_score', 
@@ -36,4 +49,26 @@ finops_resource_utilization = Gauge(
     'finops_resource_utilization',
     'Ratio of actual usage vs requested resources (ideal ~0.7-0.8)',
     ['exported_namespace', 'resource_type']
-)
\ No newline at end of file
+)
+
+# Cached label children for the per-namespace gauges, which are set for every
+# namespace on each refresh; avoids resolving the labels on every set()
+@lru_cache(maxsize=4096)
+def efficiency_score_for(namespace):
+    return finops_efficiency_score.labels(namespace)
+
+@lru_cache(maxsize=4096)
+def resource_waste_for(namespace, resource_type):
+    return finops_resource_waste.labels(namespace, resource_type)
+
+@lru_cache(maxsize=4096)
+def resource_utilization_for(namespace, resource_type):
+    return finops_resource_utilization.labels(namespace, resource_type)
+
+@lru_cache(maxsize=4096)
+def anomaly_score_for(namespace):
+    return finops_anomaly_score.labels(namespace)
+
+@lru_cache(maxsize=4096)
+def optimization_savings_for(namespace, recommendation_type):
+    return finops_optimization_savings.labels(namespace, recommendation_type)
@@ -1,18 +1,32 @@
+from dataclasses import dataclass
+import numpy as np
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any, Union
+from typing import List, Union
 
+# Numeric resource fields, one NamespaceTable column each
+RESOURCE_FIELDS = ('cpu_usage', 'cpu_request', 'cpu_limit', 'memory_usage', 'memory_request', 'memory_limit', 'cost')
+
+
+@dataclass
+class NamespaceTable:
+    """Resource usage and allocation data for all namespaces, stored as one
+    float64 array per field so insights can be computed for every namespace
+    at once"""
+    namespaces: List[str]
+    cpu_usage: np.ndarray
+    cpu_request: np.ndarray
+    cpu_limit: np.ndarray
+    memory_usage: np.ndarray
+    memory_request: np.ndarray
+    memory_limit: np.ndarray
+    cost: np.ndarray
+
+    def __len__(self):
+        return len(self.namespaces)
 
-class ResourceData(BaseModel):
-    """Resource usage and allocation data for a namespace"""
-    namespace: str
-    cpu_usage: float
-    cpu_request: float
-    cpu_limit: float
-    memory_usage: float
-    memory_request: float
-    memory_limit: float
-    cost: float
 
+# The insights module builds these from values it has already typed, using
+# model_construct, so they are not re-validated on the request path.
 
 class CostAnomaly(BaseModel):
     """Cost anomaly detection result"""
@@ -1,107 +1,387 @@
 import logging
+import math
 import os
-from typing import Dict, Any, List, Optional
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+import httpx
+import orjson
 from fastapi import HTTPException
-from prometheus_api_client import PrometheusConnect, PrometheusApiClientException
 from prometheus_client import push_to_gateway
-import requests
+
+from .cache import async_ttl_cache
 
 logger = logging.getLogger(__name__)
 
 # Environment variables with default values
 PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://prometheus-kube-prometheus-prometheus.monitoring.svc.cluster.local:9090")
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "http://prometheus-pushgateway.monitoring.svc.cluster.local:9091")
+PROMETHEUS_TIMEOUT = float(os.getenv("PROMETHEUS_TIMEOUT", "10"))
+# Instant query results are reused for PROM_CACHE_TTL seconds, for up to
+# PROM_CACHE_SIZE distinct queries
+PROM_CACHE_SIZE = int(os.getenv("PROM_CACHE_SIZE", "1024"))
+PROM_CACHE_TTL = float(os.getenv("PROM_CACHE_TTL", "15"))
+# Evaluation timestamps are rounded down to a multiple of PROM_QUANTIZE_STEP
+# seconds, so dashboards polling at slightly different moments share entries
+PROM_QUANTIZE_STEP = float(os.getenv("PROM_QUANTIZE_STEP", "15"))
 
-# Global Prometheus client
-prom_client = None
+# After PROM_BREAKER_FAIL_MAX consecutive failures, queries are skipped for
+# PROM_BREAKER_RESET_TIMEOUT seconds instead of each waiting out the timeout
+PROM_BREAKER_FAIL_MAX = int(os.getenv("PROM_BREAKER_FAIL_MAX", "5"))
+PROM_BREAKER_RESET_TIMEOUT = float(os.getenv("PROM_BREAKER_RESET_TIMEOUT", "30"))
+
+# Pushgateway pushes requested within PUSH_FLUSH_INTERVAL seconds of each
+# other are sent together, once per job
+PUSH_FLUSH_INTERVAL = float(os.getenv("PUSH_FLUSH_INTERVAL", "2"))
 
-def get_prometheus_client():
+# PromQL string literals, kept verbatim when canonicalizing a query
+_STRING = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`'
+# A string literal, a # comment, a {...} label matcher list or a run of
+# whitespace
+_QUERY_TOKEN = re.compile(rf'{_STRING}|#[^\n]*|\{{(?:{_STRING}|[^{{}}"\'`])*\}}|\s+')
+_LABEL_MATCHER = re.compile(rf'\s*([A-Za-z_]\w*)\s*(=~|!~|!=|=)\s*({_STRING})\s*(?:,|$)')
+
+@dataclass(slots=True)
+class PromResult:
     """
-    Get or initialize the Prometheus client
+    Result list of a Prometheus query, i.e. the data.result of the API
+    response
     """
-    global prom_client
-    if prom_client is None:
-        try:
-            prometheus_url = os.getenv("PROMETHEUS_URL", "http://prometheus-kube-prometheus-prometheus.monitoring.svc.cluster.local:9090")
-            prom_client = PrometheusConnect(url=prometheus_url, disable_ssl=True, headers={"Connection": "close"})
-            prom_client.check_prometheus_connection()
-            logger.info(f"Successfully connected to Prometheus at {prometheus_url}")
-        except Exception as e:
-            logger.error(f"Failed to initialize Prometheus client: {e}")
-            prom_client = FallbackPrometheusClient(PROMETHEUS_URL)
-    return prom_client
+    result: List[Dict[str, Any]]
+
+# Helpers below also accept the raw {"data": {"result": ...}} API shape
+PromResponse = Union[PromResult, Dict[str, Any]]
 
-class FallbackPrometheusClient:
+def _result_list(prometheus_response: PromResponse) -> List[Dict[str, Any]]:
+    if isinstance(prometheus_response, PromResult):
+        return prometheus_response.result
+    return prometheus_response['data']['result']
+
+class AsyncPrometheusClient:
     """
-    Fallback implementation if the PrometheusConnect client fails to initialize
+    Async client for the Prometheus HTTP query API. All queries share one pool
+    of keep-alive connections, so concurrent queries can be issued with
+    asyncio.gather; HTTP/2 is negotiated when Prometheus is served over TLS.
     """
-    def __init__(self, url):
+    def __init__(self, url: str):
         self.url = url
-        logger.info(f"Using fallback Prometheus client for {url}")
+        self._http = httpx.AsyncClient(
+            base_url=url,
+            http2=True,
+            timeout=PROMETHEUS_TIMEOUT,
+            # Keep idle connections well beyond httpx's 5s default so they
+            # survive between dashboard polls and background refreshes;
+            # Prometheus itself only closes idle connections after minutes
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+        )
     
-    def custom_query(self, query):
+    async def custom_query(self, query: str, eval_time: Optional[float] = None) -> List[Dict[str, Any]]:
         """
-        Fallback implementation of the custom_query method
+        Run an instant query, evaluated at eval_time if given (otherwise now), and
+        return its result list
         """
-        try:
-            response = requests.get(f"{self.url}/api/v1/query", params={"query": query})
-            response.raise_for_status()
-            data = response.json()
-            if 'data' in data and 'result' in data['data']:
-                return data['data']['result']
-            return []
-        except Exception as e:
-            logger.error(f"Error in fallback Prometheus query: {e}")
-            return []
+        params = {"query": query}
+        if eval_time is not None:
+            params["time"] = eval_time
+        return await self._query("/api/v1/query", params)
+    
+    async def custom_query_range(self, query: str, start: float, end: float, step: str) -> List[Dict[str, Any]]:
+        """
+        Run a range query and return its result list
+        """
+        return await self._query("/api/v1/query_range", {"query": query, "start": start, "end": end, "step": step})
+    
+    async def _query(self, path: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # POST keeps long multi-line queries out of the URL
+        response = await self._http.post(path, data=params)
+        response.raise_for_status()
+        # orjson decodes the (potentially large) body much faster than
+        # response.json(); sample values stay strings, as Prometheus sends them
+        return orjson.loads(response.content)['data']['result']
+    
+    async def aclose(self):
+        """
+        Close the pooled connections
+        """
+        await self._http.aclose()
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of querying Prometheus while the circuit breaker is open
+    """
 
-def query_prometheus(query: str) -> Dict[str, Any]:
+class CircuitBreaker:
     """
-    Execute a PromQL query against the Prometheus API using the client library
+    Track consecutive failures of an upstream service. Once fail_max calls in
+    a row have failed the breaker opens for reset_timeout seconds; after that
+    calls are let through again, and the next failure reopens it.
     """
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+    
+    def is_open(self) -> bool:
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+    
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+    
+    def record_failure(self):
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            self._opened_at = time.monotonic()
+
+_breaker = CircuitBreaker(PROM_BREAKER_FAIL_MAX, PROM_BREAKER_RESET_TIMEOUT)
+
+async def _call_prometheus(method, *args) -> List[Dict[str, Any]]:
+    """
+    Call a client method through the circuit breaker. While the breaker is
+    open, fail fast with CircuitOpenError without contacting Prometheus, so
+    caches keep serving their last good value.
+    """
+    if _breaker.is_open():
+        raise CircuitOpenError("Prometheus circuit breaker is open")
     try:
-        client = get_prometheus_client()
-        result = client.custom_query(query=query)
-        return {"data": {"result": result}}
+        result = await method(*args)
+    except Exception as e:
+        # A rejected query (4xx) says nothing about Prometheus' health
+        if not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500):
+            _breaker.record_failure()
+        raise
+    _breaker.record_success()
+    return result
+
+# Global Prometheus client
+prom_client: Optional[AsyncPrometheusClient] = None
+
+def get_prometheus_client() -> AsyncPrometheusClient:
+    """
+    Get or initialize the shared Prometheus client.
+    
+    Callers all run on the event loop thread and nothing is awaited between
+    the check and the assignment, so only one client (and connection pool) is
+    ever created. Broken connections are evicted by the pool itself, so the
+    client never needs rebuilding after a failed query.
+    """
+    global prom_client
+    if prom_client is None:
+        prom_client = AsyncPrometheusClient(PROMETHEUS_URL)
+        logger.info(f"Created Prometheus client for {PROMETHEUS_URL}")
+    return prom_client
+
+async def close_prometheus_client():
+    """
+    Close the shared Prometheus client and its pooled connections
+    """
+    global prom_client
+    _cached_instant_query.cache_clear()
+    if prom_client is not None:
+        await prom_client.aclose()
+        prom_client = None
+
+def _canon_token(match: re.Match) -> str:
+    token = match.group()
+    if token[0] in '"\'`#':
+        return token
+    if token[0] != '{':
+        # Newlines end # comments, so keep them
+        return '\n' if '\n' in token else ' '
+    inner = token[1:-1]
+    matchers = []
+    end = 0
+    for matcher in _LABEL_MATCHER.finditer(inner):
+        if matcher.start() != end:
+            break
+        matchers.append(''.join(matcher.groups()))
+        end = matcher.end()
+    if end != len(inner):
+        # Not a plain matcher list; leave it as written
+        return token
+    return '{' + ','.join(sorted(matchers)) + '}'
+
+def _canon(query: str) -> str:
+    """
+    Canonicalize a PromQL query so that queries differing only in whitespace
+    or label matcher order share a cache entry. String literals and comments
+    are kept as written. Only used as the cache key; Prometheus is sent the
+    query as the caller wrote it.
+    """
+    return _QUERY_TOKEN.sub(_canon_token, query.strip())
+
+async def query_prometheus(query: str, eval_time: Optional[float] = None) -> PromResult:
+    """
+    Execute an instant PromQL query against the Prometheus HTTP API,
+    evaluated at eval_time (a Unix timestamp, quantized to PROM_QUANTIZE_STEP) if
+    given. Repeated queries within PROM_CACHE_TTL seconds are answered from
+    memory.
+    """
+    if eval_time is not None:
+        eval_time = math.floor(eval_time / PROM_QUANTIZE_STEP) * PROM_QUANTIZE_STEP
+    return await _cached_instant_query(query.strip(), eval_time)
+
+# Empty results are not cached: they are often transient (e.g. right after
+# a Prometheus restart) and cheap to ask again
+@async_ttl_cache(
+    ttl=PROM_CACHE_TTL,
+    maxsize=PROM_CACHE_SIZE,
+    cache_if=lambda response: response.result,
+    key=lambda query, eval_time: (_canon(query), eval_time),
+)
+async def _cached_instant_query(query: str, eval_time: Optional[float]) -> PromResult:
+    try:
+        result = await _call_prometheus(get_prometheus_client().custom_query, query, eval_time)
+        return PromResult(result)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error querying Prometheus: {e}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-def extract_metric_value(prometheus_response: Dict[str, Any], default: float = 0) -> float:
+async def refresh_instant_query(query: str) -> PromResult:
     """
-    Extract a single value from a Prometheus response
+    Re-run an instant PromQL query now and update its cache entry, even if
+    the cached response hasn't expired yet
     """
-    if (prometheus_response and 'data' in prometheus_response and 
-        'result' in prometheus_response['data'] and 
-        len(prometheus_response['data']['result']) > 0):
-        
-        result = prometheus_response['data']['result'][0]
-        if 'value' in result:
-            return float(result['value'][1])
-        
-    return default
+    return await _cached_instant_query.refresh(query.strip(), None)
 
-def extract_namespace_results(prometheus_response: Dict[str, Any]) -> Dict[str, float]:
+async def query_prometheus_range(query: str, start: float, end: float, step: str) -> PromResult:
     """
-    Extract namespace-specific results from a Prometheus response
+    Execute a PromQL range query against the Prometheus HTTP API
     """
-    results = {}
-    
-    if prometheus_response and 'data' in prometheus_response and 'result' in prometheus_response['data']:
-        for item in prometheus_response['data']['result']:
-            if 'metric' in item and 'namespace' in item['metric'] and 'value' in item:
-                namespace = item['metric']['namespace']
-                results[namespace] = float(item['value'][1])
+    try:
+        result = await _call_prometheus(get_prometheus_client().custom_query_range, query, start, end, step)
+        return PromResult(result)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error querying Prometheus: {e}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+def iter_series(prometheus_response: PromResponse, *labels: str) -> Iterator[Tuple]:
+    """
+    Yield (label values..., value) for each series of an instant query
+    response, skipping series that lack one of the labels or a value
+    """
+    try:
+        results = _result_list(prometheus_response)
+    except (KeyError, TypeError):
+        return
     
-    return results
+    for item in results:
+        try:
+            metric = item['metric']
+            row = (*[metric[label] for label in labels], float(item['value'][1]))
+        except (KeyError, IndexError, TypeError):
+            continue
+        yield row
+
+def extract_namespace_results(prometheus_response: PromResponse) -> Dict[str, float]:
+    """
+    Extract namespace-specific results from a Prometheus response
+    """
+    return dict(iter_series(prometheus_response, 'namespace'))
+
+# Jobs waiting to be pushed, drained by a single background thread
+_push_queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=1024)
+_push_worker: Optional[threading.Thread] = None
+_push_worker_lock = threading.Lock()
+# Keep-alive connection to the Pushgateway, only used by the push thread
+_push_http: Optional[httpx.Client] = None
 
 def push_to_prometheus(job: str = 'finops_api') -> bool:
+    """
+    Queue a push of metrics to Prometheus Pushgateway. The push happens on a
+    background thread, so callers don't wait on the Pushgateway round trip.
+    Returns False if the push could not be queued.
+    """
+    global _push_worker
+    with _push_worker_lock:
+        if _push_worker is None:
+            _push_worker = threading.Thread(target=_push_worker_loop, name="pushgateway", daemon=True)
+            _push_worker.start()
+    try:
+        _push_queue.put_nowait(job)
+        return True
+    except queue.Full:
+        logger.warning(f"Pushgateway queue is full, dropping push for job '{job}'")
+        return False
+
+def stop_push_worker(timeout: float = 5):
+    """
+    Send any queued pushes and stop the background push thread, waiting at
+    most about timeout seconds. Blocks, so call it off the event loop.
+    """
+    global _push_worker, _push_http
+    with _push_worker_lock:
+        worker, _push_worker = _push_worker, None
+    if worker is not None:
+        deadline = time.monotonic() + timeout
+        try:
+            _push_queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Pushgateway queue is full, not waiting for queued pushes")
+        else:
+            worker.join(max(deadline - time.monotonic(), 0))
+        if worker.is_alive():
+            # The thread may still be pushing; leave its connection open
+            logger.warning("Pushgateway pushes still in progress at shutdown")
+            return
+    
+    if _push_http is not None:
+        _push_http.close()
+        _push_http = None
+
+def _push_worker_loop():
+    # None in the queue means stop once the pending jobs are pushed
+    stopping = False
+    while not stopping:
+        job = _push_queue.get()
+        if job is None:
+            return
+        jobs = {job}
+        deadline = time.monotonic() + PUSH_FLUSH_INTERVAL
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = _push_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            jobs.add(job)
+        for job in jobs:
+            _push(job)
+
+def _push_handler(url, method, timeout, headers, data):
+    """
+    push_to_gateway handler that reuses one pooled connection instead of
+    opening a new one per push
+    """
+    def handle():
+        global _push_http
+        if _push_http is None:
+            _push_http = httpx.Client(timeout=PROMETHEUS_TIMEOUT)
+        _push_http.request(method, url, content=data, headers=dict(headers), timeout=timeout).raise_for_status()
+    return handle
+
+def _push(job: str) -> bool:
     """
     Push metrics to Prometheus Pushgateway
     """
     try:
-        push_to_gateway(PUSHGATEWAY_URL, job=job, registry=None)
+        # registry=None pushes the default registry, where metrics.py registers
+        push_to_gateway(PUSHGATEWAY_URL, job=job, registry=None, handler=_push_handler)
         logger.info(f"Successfully pushed metrics to Prometheus Pushgateway as job '{job}'")
         return True
     except Exception as e:
         logger.error(f"Failed to push metrics to Prometheus Pushgateway: {e}")
-        return False
\ No newline at end of file
+        return False
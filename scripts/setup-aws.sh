@@ -75,6 +75,10 @@ kubectl wait --for=condition=available --timeout=300s deployment/opencost -n $NA
 echo "Applying FinOps alert rules..."
 kubectl apply -f kubernetes/finops-alerts.yaml
 
+# Apply FinOps recording rules (used by the FinOps API)
+echo "Applying FinOps recording rules..."
+kubectl apply -f finops-recording-rules.yaml
+
 # Apply LoadBalancer services for external access
 echo "Creating service configuration for external access..."
 
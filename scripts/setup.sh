@@ -65,6 +65,10 @@ kubectl wait --for=condition=available --timeout=300s deployment/opencost -n ope
 echo "Applying FinOps alert rules..."
 kubectl apply -f finops-alerts.yml
 
+# Apply FinOps recording rules (used by the FinOps API)
+echo "Applying FinOps recording rules..."
+kubectl apply -f finops-recording-rules.yaml
+
 # Wait for ingress controller to be ready
 echo "Waiting for ingress controller to be ready..."
 kubectl wait --namespace ingress-nginx \